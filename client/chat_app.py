@@ -1,77 +1,271 @@
 import streamlit as st
 import asyncio
-import json # Added for parsing tool arguments and debug printing
+import atexit
+import logging
+import os
+import threading
+import time
+import weakref
+import orjson # Fast JSON parsing of tool arguments and debug logging
+from dataclasses import asdict, dataclass, field, is_dataclass
+from typing import Optional
 from openai import AsyncOpenAI # Using the official async client
 from mcp.client.session import ClientSession
 from mcp.client.streamable_http import streamablehttp_client
+from mcp.shared.exceptions import McpError
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+
+try:
+    import uvloop
+except ImportError: # uvloop is not available on Windows; fall back to the default asyncio loop
+    uvloop = None
+
+# Configure basic logging; set MCP_LOG_LEVEL=DEBUG to see connection and tool call details
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+logger = logging.getLogger("mcp_client")
+MCP_LOG_LEVEL = (os.getenv("MCP_LOG_LEVEL") or "INFO").upper()
+if MCP_LOG_LEVEL not in logging.getLevelNamesMapping():
+    logger.warning("Unknown MCP_LOG_LEVEL %r, using INFO.", MCP_LOG_LEVEL)
+    MCP_LOG_LEVEL = "INFO"
+logger.setLevel(MCP_LOG_LEVEL)
 
 # --- Configuration ---
 DEFAULT_OPENAI_MODEL = "gpt-3.5-turbo" # Simpler, endpoint is inferred by client
+STREAM_FLUSH_SECONDS = 0.04 # Streamed text is written to the UI at most this often
+MCP_INITIALIZE_TIMEOUT_SECONDS = 5
+MCP_TOOL_CALL_TIMEOUT_SECONDS = 30 # A slow tool gets an error result instead of stalling the chat turn
+
+# --- Background Event Loop ---
+class BackgroundLoop:
+    """An event loop running forever on a daemon thread.
+
+    Once this object is garbage collected (its Streamlit session was dropped), the MCP connections
+    opened on the loop are closed and the loop is stopped.
+    """
+    def __init__(self):
+        # libuv-backed where available; created directly so the process-wide loop policy is left alone
+        self.loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+        self.connections = set() # MCPConnections opened on this loop, kept alive until closed
+        self.thread = threading.Thread(target=run_loop_until_stopped, args=(self.loop,), name="mcp-client-loop", daemon=True)
+        self.thread.start()
+        weakref.finalize(self, stop_background_loop, self.loop, self.connections)
+
+def run_loop_until_stopped(loop):
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
+
+def stop_background_loop(loop, connections):
+    # Close the loop's MCP sessions first, so the server receives the session DELETE, then stop it
+    async def shutdown():
+        try:
+            await asyncio.wait_for(asyncio.gather(*(c.close() for c in list(connections)), return_exceptions=True), timeout=5)
+        except TimeoutError:
+            logger.debug("Timed out closing MCP connections before stopping the background loop.")
+        finally:
+            loop.stop()
+    if loop.is_running():
+        asyncio.run_coroutine_threadsafe(shutdown(), loop)
+
+def run_async(coro):
+    """Runs coro on this Streamlit session's background event loop and waits for its result.
+
+    Unlike asyncio.run, the loop survives between reruns, so the cached MCP session and
+    connection pools created on it are reused across chat turns.
+    """
+    if st.session_state.get("background_loop") is None:
+        st.session_state.background_loop = BackgroundLoop()
+    background_loop = st.session_state.background_loop
+    # Coroutines call st.* from the loop thread, so give it this rerun's script context. It is detached
+    # afterwards: the context holds session_state, which would otherwise keep this BackgroundLoop alive
+    add_script_run_ctx(background_loop.thread, get_script_run_ctx())
+    try:
+        return asyncio.run_coroutine_threadsafe(coro, background_loop.loop).result()
+    finally:
+        if hasattr(background_loop.thread, SCRIPT_RUN_CONTEXT_ATTR_NAME):
+            delattr(background_loop.thread, SCRIPT_RUN_CONTEXT_ATTR_NAME)
 
 # --- MCP Connection Management ---
+@dataclass(eq=False)
+class MCPConnection:
+    """A live MCP session kept open by a background task on the event loop that opened it.
+
+    The streamable HTTP transport and ClientSession are async context managers that must be
+    entered and exited from the same task, so a dedicated task holds them open until close().
+    Every list_*, read_resource and call_tool request is multiplexed over this one session.
+    """
+    server_address: str
+    loop: asyncio.AbstractEventLoop
+    session: Optional[ClientSession] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    _task: Optional[asyncio.Task] = None
+    _ready: asyncio.Event = field(default_factory=asyncio.Event)
+    _closing: asyncio.Event = field(default_factory=asyncio.Event)
+
+    async def _run(self):
+        try:
+            async with streamablehttp_client(self.server_address) as (read_stream, write_stream, info):
+                logger.debug("HTTP connection established. Info from streamablehttp_client: %s", info)
+                async with ClientSession(read_stream, write_stream) as session:
+                    try:
+                        async with asyncio.timeout(MCP_INITIALIZE_TIMEOUT_SECONDS):
+                            init_result = await session.initialize()
+                    except TimeoutError:
+                        raise TimeoutError(f"MCP session did not initialize within {MCP_INITIALIZE_TIMEOUT_SECONDS} seconds.") from None
+                    logger.debug("Session initialized successfully. Server info: %s", init_result.serverInfo)
+                    self.session = session
+                    self._ready.set()
+                    await self._closing.wait()
+        finally:
+            self.session = None
+            self._ready.set()
+
+    async def get_session(self) -> ClientSession:
+        async with self.lock:
+            if self.session is None:
+                if self._task is not None and not self._task.done():
+                    raise RuntimeError(f"MCP connection to {self.server_address} is closing.")
+                self._log_task_exit()
+                self._ready.clear()
+                self._task = asyncio.create_task(self._run())
+                await self._ready.wait()
+                if self.session is None:
+                    try:
+                        await self._task # Re-raise whatever stopped the connection
+                    except BaseExceptionGroup as e:
+                        # The transport's anyio task group wraps errors; report the underlying cause
+                        cause = unwrap_exception_group(e)
+                        if cause is e:
+                            raise
+                        raise cause from e
+                    raise RuntimeError(f"MCP connection to {self.server_address} closed during initialization.")
+                get_live_mcp_connections().add(self)
+            return self.session
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._closing.set()
+            await self._task
+        else:
+            self._log_task_exit()
+
+    def _log_task_exit(self):
+        # Retrieves the error of a connection that dropped on its own (e.g. the server restarted)
+        if self._task is not None and self._task.done() and not self._task.cancelled() and self._task.exception():
+            logger.debug("MCP connection to %s was lost: %s", self.server_address, unwrap_exception_group(self._task.exception()))
+
+def unwrap_exception_group(exc: BaseException) -> BaseException:
+    # Strips groups with a single sub-exception, e.g. a TimeoutError raised inside streamablehttp_client
+    while isinstance(exc, BaseExceptionGroup) and len(exc.exceptions) == 1:
+        exc = exc.exceptions[0]
+    return exc
+
+def close_mcp_connections(connections):
+    # Runs at interpreter exit, while the daemon loop threads are still alive
+    for connection in list(connections):
+        if connection.loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(connection.close(), connection.loop).result(timeout=5)
+            except Exception as e:
+                logger.debug("Error closing MCP connection to %s: %s", connection.server_address, e)
+
+@st.cache_resource
+def get_live_mcp_connections():
+    """Process-wide registry of open MCP connections, closed at interpreter exit.
+
+    Cached as a resource because Streamlit re-executes this module on every rerun.
+    """
+    connections = weakref.WeakSet()
+    atexit.register(close_mcp_connections, connections)
+    return connections
+
+async def get_cached_session(server_address: str) -> ClientSession:
+    """Return the MCP session cached for this Streamlit session, connecting on first use."""
+    loop = asyncio.get_running_loop()
+    connection = st.session_state.get("mcp_connection")
+    if connection is None or connection.server_address != server_address or connection.loop is not loop:
+        if connection is not None and connection.loop is loop:
+            await close_cached_session()
+        connection = MCPConnection(server_address=server_address, loop=loop)
+        st.session_state.mcp_connection = connection
+        st.session_state.background_loop.connections.add(connection)
+    return await connection.get_session()
+
+async def close_cached_session():
+    connection = st.session_state.get("mcp_connection")
+    if connection is not None and connection.loop is asyncio.get_running_loop():
+        await connection.close()
+        st.session_state.background_loop.connections.discard(connection)
+    st.session_state.mcp_connection = None
+
+async def ping_cached_session(server_address: str) -> bool:
+    # True if the cached session for server_address is open and still answers the server
+    connection = st.session_state.get("mcp_connection")
+    if (connection is None or connection.session is None or connection.server_address != server_address
+            or connection.loop is not asyncio.get_running_loop()):
+        return False
+    try:
+        await asyncio.wait_for(connection.session.send_ping(), timeout=5)
+        return True
+    except Exception as e:
+        logger.debug("Cached MCP session to %s did not answer ping: %s", server_address, e)
+        return False
+
 async def async_connect_mcp_server(target_address: str):
-    print(f"[DEBUG MCP] Attempting to connect. User provided server_address: {target_address}")
+    logger.debug("Attempting to connect. User provided server_address: %s", target_address)
     if not target_address or not target_address.startswith(("http://", "https://")):
         return None, "MCP Server Address must be a valid HTTP/HTTPS URL.", [], []
 
-    print(f"[DEBUG MCP] Using provided target address: {target_address}")
     try:
-        print(f"[DEBUG MCP] Attempting to establish HTTP connection with streamablehttp_client to: {target_address}")
-        async with streamablehttp_client(target_address) as (read_stream, write_stream, info):
-            print("[DEBUG MCP] HTTP connection established. read_stream, write_stream, info obtained.")
-            print(f"[DEBUG MCP] Info from streamablehttp_client: {info}")
-            print("[DEBUG MCP] Creating ClientSession.")
-            async with ClientSession(read_stream, write_stream) as session:
-                print("[DEBUG MCP] ClientSession created. Attempting to initialize session...")
-                await session.initialize()
-                print("[DEBUG MCP] Session initialized successfully.")
-
-                # Attempt to list tools using the newly discovered list_tools() method
-                tool_schemas = []
-                try:
-                    mcp_tools_result = await session.list_tools()
-                    print(f"[DEBUG MCP] list_tools() result: {mcp_tools_result}")
-                    if hasattr(mcp_tools_result, 'tools') and mcp_tools_result.tools:
-                        tool_schemas = mcp_tools_result.tools
-                        print(f"[DEBUG MCP] Fetched tool schemas: {tool_schemas}")
-                    else:
-                        print("[DEBUG MCP] No tool schemas found in list_tools() result object or it's empty.")
-                except Exception as e_lt:
-                    print(f"[DEBUG MCP] Error calling session.list_tools(): {e_lt}")
-                
-                # Attempt to list resources
-                resources_list = []
-                print("[DEBUG MCP] Attempting to list resources...")
-                mcp_resources_result = await session.list_resources()
-                print(f"[DEBUG MCP] list_resources result: {mcp_resources_result}")
-                if hasattr(mcp_resources_result, 'resources') and mcp_resources_result.resources is not None:
-                    resources_list = mcp_resources_result.resources
-                    print(f"[DEBUG MCP] Extracted resources (from object.resources): {resources_list}")
-                else:
-                    print("[DEBUG MCP] No resources found or unexpected format for mcp_resources_result.")
-                
-                print("[DEBUG MCP] Connection, tool and resource listing successful.")
-                return None, f"Successfully connected to MCP Server at {target_address}.", resources_list, tool_schemas
+        # Keep using the open session (and its HTTP/SSE stream) while it is healthy; otherwise start fresh
+        if not await ping_cached_session(target_address):
+            await close_cached_session()
+        logger.debug("Attempting to establish HTTP connection with streamablehttp_client to: %s", target_address)
+        session = await get_cached_session(target_address)
+
+        # Attempt to list tools using the newly discovered list_tools() method
+        tool_schemas = []
+        try:
+            mcp_tools_result = await session.list_tools()
+            logger.debug("list_tools() result: %s", mcp_tools_result)
+            if hasattr(mcp_tools_result, 'tools') and mcp_tools_result.tools:
+                tool_schemas = mcp_tools_result.tools
+                logger.debug("Fetched tool schemas: %s", tool_schemas)
+            else:
+                logger.debug("No tool schemas found in list_tools() result object or it's empty.")
+        except Exception as e_lt:
+            logger.debug("Error calling session.list_tools(): %s", e_lt)
+
+        # Attempt to list resources
+        resources_list = []
+        logger.debug("Attempting to list resources...")
+        mcp_resources_result = await session.list_resources()
+        logger.debug("list_resources result: %s", mcp_resources_result)
+        if hasattr(mcp_resources_result, 'resources') and mcp_resources_result.resources is not None:
+            resources_list = mcp_resources_result.resources
+            logger.debug("Extracted resources (from object.resources): %s", resources_list)
+        else:
+            logger.debug("No resources found or unexpected format for mcp_resources_result.")
+
+        logger.debug("Connection, tool and resource listing successful.")
+        return session, f"Successfully connected to MCP Server at {target_address}.", resources_list, tool_schemas
     except Exception as e:
-        print(f"[DEBUG MCP] EXCEPTION during MCP connection/initialization: {type(e).__name__}: {e}")
-        import traceback
-        print("[DEBUG MCP] Traceback:")
-        traceback.print_exc()
+        logger.debug("EXCEPTION during MCP connection/initialization: %s: %s", type(e).__name__, e, exc_info=True)
         return None, f"Failed to connect to MCP Server at {target_address}: {e}", [], []
 
 async def async_read_mcp_resource(server_address, resource_uri: str):
     try:
-        print(f"[DEBUG MCP] Attempting to read resource: {resource_uri}")
-        async with streamablehttp_client(server_address) as (read_stream, write_stream, info):
-            async with ClientSession(read_stream, write_stream) as session:
-                await session.initialize()
-                content = await session.read_resource(uri=resource_uri)
-                if isinstance(content, bytes):
-                    content = content.decode()
-                print(f"[DEBUG MCP] Read resource content: {content if content else '<empty>'}")
-                return content if content else "Resource is empty or content could not be decoded."
+        logger.debug("Attempting to read resource: %s", resource_uri)
+        session = await get_cached_session(server_address)
+        content = await session.read_resource(uri=resource_uri)
+        if isinstance(content, bytes):
+            content = content.decode()
+        logger.debug("Read resource content: %s", content if content else '<empty>')
+        return content if content else "Resource is empty or content could not be decoded."
     except Exception as e:
-        print(f"[DEBUG MCP] Error reading MCP resource {resource_uri}: {e}")
+        logger.debug("Error reading MCP resource %s: %s", resource_uri, e)
         return f"Error reading resource {resource_uri}: {e}"
 
 # --- OpenAI Interaction Logic ---
@@ -95,55 +289,173 @@ def format_mcp_tools_for_openai(mcp_tools):
         })
     return openai_tools
 
+# Tools may declare an "x-display-template" annotation: a str.format template rendered with the
+# fields of their JSON object result, shown to the user instead of asking the LLM to summarize it
+DISPLAY_TEMPLATE_ANNOTATION = "x-display-template"
+
+def get_display_templates(mcp_tools):
+    templates = {}
+    for tool in mcp_tools or []:
+        extra = tool.annotations.model_extra if tool.annotations else None
+        if extra and isinstance(extra.get(DISPLAY_TEMPLATE_ANNOTATION), str):
+            templates[tool.name] = extra[DISPLAY_TEMPLATE_ANNOTATION]
+    return templates
+
+def render_display_template(template, mcp_tool_response):
+    # Returns None when the result doesn't fit the template (e.g. an error), so the caller can fall back to the LLM
+    if getattr(mcp_tool_response, 'isError', False) or not getattr(mcp_tool_response, 'content', None):
+        return None
+    try:
+        data = orjson.loads(mcp_tool_response.content[0].text)
+        if not isinstance(data, dict):
+            return None
+        return template.format(**data)
+    except (AttributeError, IndexError, KeyError, ValueError):
+        return None
+
+async def call_mcp_tool(session: ClientSession, name: str, arguments: dict):
+    # Timeouts and errors reported by the server for this call become error results the LLM can recover from;
+    # anything else (e.g. a broken session) propagates so the caller's TaskGroup cancels the other calls
+    try:
+        async with asyncio.timeout(MCP_TOOL_CALL_TIMEOUT_SECONDS):
+            return await session.call_tool(name=name, arguments=arguments)
+    except TimeoutError:
+        logger.error("MCP tool '%s' timed out after %s seconds.", name, MCP_TOOL_CALL_TIMEOUT_SECONDS)
+        return {"error": f"Tool {name} timed out after {MCP_TOOL_CALL_TIMEOUT_SECONDS} seconds."}
+    except McpError as e:
+        logger.error("MCP tool '%s' failed: %s", name, e)
+        return {"error": f"Tool {name} failed: {e}"}
+
+def _to_json(obj):
+    # orjson default= hook for values it can't serialize natively, e.g. MCP's pydantic content blocks
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump(mode="json", exclude_none=True)
+    if is_dataclass(obj):
+        return asdict(obj)
+    if isinstance(obj, bytes):
+        return obj.decode(errors="replace")
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def format_tool_result_content(mcp_tool_response) -> str:
+    # Tool results are sent to the LLM as canonical JSON text rather than Python reprs
+    is_error = getattr(mcp_tool_response, 'isError', False)
+    if hasattr(mcp_tool_response, 'content'):
+        mcp_tool_response = mcp_tool_response.content
+    if mcp_tool_response is None or mcp_tool_response == []:
+        return "Tool executed successfully but returned no content."
+    if isinstance(mcp_tool_response, list) and all(getattr(block, 'type', None) == "text" for block in mcp_tool_response):
+        # Text blocks already hold the tool's own serialized output, so pass them through unescaped
+        content = "\n".join(block.text for block in mcp_tool_response)
+    elif isinstance(mcp_tool_response, str):
+        content = mcp_tool_response
+    else:
+        content = orjson.dumps(mcp_tool_response, default=_to_json).decode()
+    return f"Error: {content}" if is_error else content
+
+# --- Chat History ---
+# The latest assistant message indices are tracked at append time, so building the
+# OpenAI request never scans the whole conversation.
+def append_msg(message):
+    messages = st.session_state.messages
+    messages.append(message)
+    if message.get('role') == 'assistant':
+        st.session_state.last_assistant_idx = len(messages) - 1
+        if message.get('tool_calls'):
+            st.session_state.last_tool_call_assistant_idx = len(messages) - 1
+
+def reset_messages():
+    # Cached indices are only valid for the list they were recorded against
+    st.session_state.messages = []
+    st.session_state.last_assistant_idx = None
+    st.session_state.last_tool_call_assistant_idx = None
+
+def get_tool_call_block_end(messages, idx):
+    # Index just past the tool messages that immediately follow messages[idx]
+    j = idx + 1
+    while j < len(messages) and messages[j].get('role') == 'tool':
+        j += 1
+    return j
+
+def get_message_history_for_openai(messages):
+    # If the last message is a user message, send up to the last assistant/user exchange for context
+    # If the last message is a tool call, send the last tool call block
+    if not messages:
+        return []
+    # If the last message is a user message
+    if messages[-1]['role'] == 'user':
+        # Optionally, include more history for context (here, just the last exchange)
+        # Start from the previous assistant message (if any)
+        idx = st.session_state.get("last_assistant_idx")
+        if idx is not None:
+            return messages[idx:]
+        else:
+            return [messages[-1]]
+    # If the last message is a tool message, use the last tool call block
+    else:
+        idx = st.session_state.get("last_tool_call_assistant_idx")
+        if idx is None:
+            return messages
+        return messages[idx:get_tool_call_block_end(messages, idx)]
+
+def get_last_tool_call_block(messages):
+    # Everything up to the last assistant message with tool_calls, plus the tool messages that follow it
+    idx = st.session_state.get("last_tool_call_assistant_idx")
+    if idx is None:
+        return messages  # fallback: send all (shouldn't happen)
+    return messages[:get_tool_call_block_end(messages, idx)]
+
+async def stream_chat_completion(response, placeholder):
+    """Consumes a streamed chat completion, rendering its text into placeholder as it arrives.
+
+    The first delta is shown immediately; later ones are coalesced so the placeholder is
+    redrawn at most once per STREAM_FLUSH_SECONDS rather than once per token.
+    Text and tool call deltas are collected as lists of fragments and joined once, so building
+    a long response stays linear in its length. Tool call deltas are buffered by index, since
+    their arguments are only usable once complete.
+    Returns the full text content and the assembled tool calls in OpenAI message format.
+    """
+    content_parts = []
+    flushed_parts = 0
+    last_flush = None
+    tool_calls = {}
+    async for chunk in response:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content_parts.append(delta.content)
+            now = time.monotonic()
+            if last_flush is None or now - last_flush >= STREAM_FLUSH_SECONDS:
+                placeholder.chat_message("assistant").markdown("".join(content_parts))
+                flushed_parts = len(content_parts)
+                last_flush = now
+        for tc in delta.tool_calls or []:
+            # Name and argument fragments are kept as lists and joined once the stream ends
+            buffered = tool_calls.setdefault(tc.index, {"id": "", "name": [], "arguments": []})
+            if tc.id:
+                buffered["id"] = tc.id
+            if tc.function and tc.function.name:
+                buffered["name"].append(tc.function.name)
+            if tc.function and tc.function.arguments:
+                buffered["arguments"].append(tc.function.arguments)
+    content = "".join(content_parts)
+    if flushed_parts < len(content_parts): # Show whatever arrived since the last flush
+        placeholder.chat_message("assistant").markdown(content)
+    return content, [
+        {"id": buffered["id"], "type": "function", "function": {"name": "".join(buffered["name"]), "arguments": "".join(buffered["arguments"])}}
+        for _, buffered in sorted(tool_calls.items())
+    ]
+
 async def handle_chat_message(prompt_text: str):
     """Handles the user's chat message, interacts with OpenAI and MCP tools."""
-    st.session_state.messages.append({"role": "user", "content": prompt_text})
+    append_msg({"role": "user", "content": prompt_text})
+    st.chat_message("user").write(prompt_text)
 
     client = AsyncOpenAI(api_key=st.session_state.openai_api_key) # Add base_url if not default
     
-    openai_tool_list = []
-    if "mcp_tool_schemas" in st.session_state and st.session_state.mcp_tool_schemas:
-        openai_tool_list = format_mcp_tools_for_openai(st.session_state.mcp_tool_schemas)
-        if openai_tool_list:
-            print(f"[DEBUG CHAT] Passing these tools to OpenAI: {json.dumps(openai_tool_list, indent=2)}")
-
-    def get_message_history_for_openai(messages):
-        # If the last message is a user message, send up to the last assistant/user exchange for context
-        # If the last message is a tool call, use get_last_tool_call_block
-        if not messages:
-            return []
-        # If the last message is a user message
-        if messages[-1]['role'] == 'user':
-            # Optionally, include more history for context (here, just the last exchange)
-            # Find previous assistant message (if any)
-            idx = None
-            for i in range(len(messages) - 2, -1, -1):
-                if messages[i]['role'] == 'assistant':
-                    idx = i
-                    break
-            if idx is not None:
-                return messages[idx:]
-            else:
-                return [messages[-1]]
-        # If the last message is a tool message, use the last tool call block
-        else:
-            # Reuse the previous helper
-            def get_last_tool_call_block(messages):
-                idx = None
-                for i in range(len(messages) - 1, -1, -1):
-                    m = messages[i]
-                    if m.get('role') == 'assistant' and m.get('tool_calls'):
-                        idx = i
-                        break
-                if idx is None:
-                    return messages
-                tool_msgs = []
-                j = idx + 1
-                while j < len(messages) and messages[j].get('role') == 'tool':
-                    tool_msgs.append(messages[j])
-                    j += 1
-                return messages[idx:j]
-            return get_last_tool_call_block(messages)
+    # Formatted once at connect time; tool schemas only change when reconnecting
+    openai_tool_list = st.session_state.get("openai_tool_list", [])
+    display_templates = st.session_state.get("mcp_display_templates", {})
 
     try:
         if openai_tool_list:
@@ -151,123 +463,114 @@ async def handle_chat_message(prompt_text: str):
                 model=st.session_state.openai_model,
                 messages=get_message_history_for_openai(st.session_state.messages),
                 tools=openai_tool_list,
-                tool_choice="auto"
+                tool_choice="auto",
+                stream=True
             )
         else: # No MCP tools to pass
             response = await client.chat.completions.create(
                 model=st.session_state.openai_model,
-                messages=get_message_history_for_openai(st.session_state.messages)
+                messages=get_message_history_for_openai(st.session_state.messages),
+                stream=True
             )
 
-        response_message = response.choices[0].message
+        # Text is shown as it streams in; tool calls are only acted on once fully received
+        response_content, response_tool_calls = await stream_chat_completion(response, st.empty())
 
         # Step 2: check if the model wanted to call a function
-        if response_message.tool_calls:
-            print(f"[DEBUG CHAT] OpenAI response contains tool_calls: {response_message.tool_calls}")
-            # Convert ChatCompletionMessage to dict before appending
+        if response_tool_calls:
+            logger.debug("OpenAI response contains tool_calls: %s", response_tool_calls)
             assistant_message_dict = {
-                "role": response_message.role, 
-                "content": response_message.content or "", # Ensure content is string
-                "tool_calls": [
-                    {"id": tc.id, "type": tc.type, "function": {"name": tc.function.name, "arguments": tc.function.arguments}}
-                    for tc in response_message.tool_calls
-                ]
+                "role": "assistant",
+                "content": response_content,
+                "tool_calls": response_tool_calls
             }
-            st.session_state.messages.append(assistant_message_dict)
+            append_msg(assistant_message_dict)
             
-            for tool_call in response_message.tool_calls:
-                function_name = tool_call.function.name
-                function_args_json = tool_call.function.arguments
-                tool_call_id = tool_call.id
-                
+            # Parse all arguments up front; unparseable calls get an error result instead of a call
+            tool_call_results = {}
+            direct_responses = {}
+            pending_tool_calls = []
+            for tool_call in response_tool_calls:
+                function_name = tool_call["function"]["name"]
+                function_args_json = tool_call["function"]["arguments"]
                 try:
-                    function_args = json.loads(function_args_json)
-                except json.JSONDecodeError:
-                    print(f"[ERROR MCP] Failed to parse JSON arguments for tool {function_name}: {function_args_json}")
+                    function_args = orjson.loads(function_args_json)
+                except orjson.JSONDecodeError:
+                    logger.error("Failed to parse JSON arguments for tool %s: %s", function_name, function_args_json)
                     # Send error back to LLM
-                    st.session_state.messages.append({
-                        "tool_call_id": tool_call_id,
-                        "role": "tool",
-                        "name": function_name,
-                        "content": f"Error: Could not parse arguments for tool {function_name}. Arguments received: {function_args_json}",
-                    })
-                    continue # Skip to next tool call or to re-prompting LLM
-
-                print(f"[DEBUG MCP] Calling MCP tool: {function_name} with args: {function_args}")
-                
-                async with streamablehttp_client(st.session_state.mcp_server_address) as (read_stream, write_stream, info):
-                    async with ClientSession(read_stream, write_stream) as session:
-                        await session.initialize()
-                        mcp_tool_response = await session.call_tool(
-                            name=function_name,
-                            arguments=function_args
-                        )
-                        # Process mcp_tool_response: it could be a complex object or simple data
-                        # For now, assume it's JSON serializable or has a 'content' attribute
-                        if hasattr(mcp_tool_response, 'content'):
-                            tool_call_result_content = str(mcp_tool_response.content)
-                        elif isinstance(mcp_tool_response, (dict, list)):
-                            tool_call_result_content = json.dumps(mcp_tool_response)
-                        elif mcp_tool_response is None:
-                            tool_call_result_content = "Tool executed successfully but returned no content."
-                        else:
-                            tool_call_result_content = str(mcp_tool_response)
-                        print(f"[DEBUG MCP] MCP tool '{function_name}' returned: {tool_call_result_content}")
-                st.session_state.messages.append({
-                    "tool_call_id": tool_call_id,
+                    tool_call_results[tool_call["id"]] = f"Error: Could not parse arguments for tool {function_name}. Arguments received: {function_args_json}"
+                    continue
+                logger.debug("Calling MCP tool: %s with args: %s", function_name, function_args)
+                pending_tool_calls.append((tool_call, function_args))
+
+            # MCP tools are independent I/O, so run them concurrently on the shared session
+            if pending_tool_calls:
+                session = await get_cached_session(st.session_state.mcp_server_address)
+                try:
+                    async with asyncio.TaskGroup() as tg:
+                        tool_tasks = [
+                            tg.create_task(call_mcp_tool(session, tool_call["function"]["name"], function_args))
+                            for tool_call, function_args in pending_tool_calls
+                        ]
+                except ExceptionGroup as eg:
+                    raise eg.exceptions[0] from eg # Report the first failure; the other calls were cancelled
+                for (tool_call, _), tool_task in zip(pending_tool_calls, tool_tasks):
+                    function_name = tool_call["function"]["name"]
+                    mcp_tool_response = tool_task.result()
+                    # mcp_tool_response is a CallToolResult, or an error dict from call_mcp_tool
+                    tool_call_result_content = format_tool_result_content(mcp_tool_response)
+                    logger.debug("MCP tool '%s' returned: %s", function_name, tool_call_result_content)
+                    tool_call_results[tool_call["id"]] = tool_call_result_content
+                    if function_name in display_templates:
+                        direct_response = render_display_template(display_templates[function_name], mcp_tool_response)
+                        if direct_response is not None:
+                            direct_responses[tool_call["id"]] = direct_response
+
+            # Tool results must follow the assistant message in the original tool_calls order
+            for tool_call in response_tool_calls:
+                append_msg({
+                    "tool_call_id": tool_call["id"],
                     "role": "tool",
-                    "name": function_name,
-                    "content": tool_call_result_content,
+                    "name": tool_call["function"]["name"],
+                    "content": tool_call_results[tool_call["id"]],
                 })
-            
-            # Get a new response from the LLM based on the tool's response
-            print("[DEBUG CHAT] Getting new response from LLM after tool execution...")
-
-            def get_last_tool_call_block(messages):
-                # Find the last assistant message with tool_calls
-                idx = None
-                for i in range(len(messages) - 1, -1, -1):
-                    m = messages[i]
-                    if m.get('role') == 'assistant' and m.get('tool_calls'):
-                        idx = i
-                        break
-                if idx is None:
-                    return messages  # fallback: send all (shouldn't happen)
-                # Now gather all tool messages that immediately follow
-                tool_msgs = []
-                j = idx + 1
-                while j < len(messages) and messages[j].get('role') == 'tool':
-                    tool_msgs.append(messages[j])
-                    j += 1
-                return messages[:idx+1] + tool_msgs
-
-            processed_messages_for_api = get_last_tool_call_block(st.session_state.messages)
-            second_response = await client.chat.completions.create(
-                model=st.session_state.openai_model,
-                messages=processed_messages_for_api # Only send valid OpenAI tool-call sequence
-                # No 'tools' or 'tool_choice' here for the summarizing call
-            )
-            assistant_final_response = second_response.choices[0].message
+
+            if len(direct_responses) == len(response_tool_calls):
+                # Every tool result rendered through its display template, so skip the summarizing LLM call
+                logger.debug("Answering from tool display templates without a second LLM call.")
+                final_content = "\n\n".join(direct_responses[tool_call["id"]] for tool_call in response_tool_calls)
+                st.chat_message("assistant").markdown(final_content)
+            else:
+                # Get a new response from the LLM based on the tool's response
+                logger.debug("Getting new response from LLM after tool execution...")
+
+                processed_messages_for_api = get_last_tool_call_block(st.session_state.messages)
+                second_response = await client.chat.completions.create(
+                    model=st.session_state.openai_model,
+                    messages=processed_messages_for_api, # Only send valid OpenAI tool-call sequence
+                    # No 'tools' or 'tool_choice' here for the summarizing call
+                    stream=True
+                )
+                final_content, _ = await stream_chat_completion(second_response, st.empty())
             final_assistant_dict = {
-                "role": assistant_final_response.role,
-                "content": assistant_final_response.content or "" # Ensure content is string
+                "role": "assistant",
+                "content": final_content
             }
-            st.session_state.messages.append(final_assistant_dict)
+            append_msg(final_assistant_dict)
 
         else: # No tool calls, just a regular message
-            # Convert ChatCompletionMessage to dict before appending
             assistant_message_dict = {
-                "role": response_message.role,
-                "content": response_message.content or "" # Ensure content is string
+                "role": "assistant",
+                "content": response_content
             }
-            st.session_state.messages.append(assistant_message_dict)
+            append_msg(assistant_message_dict)
 
     except Exception as e:
-        print(f"[ERROR CHAT] Error during OpenAI call or tool processing: {e}")
-        st.session_state.messages.append({"role": "assistant", "content": f"An error occurred: {e}"})
-
-    # Rerun to update the UI with the new messages
-    st.rerun()
+        logger.error("Error during OpenAI call or tool processing: %s", e)
+        error_message_dict = {"role": "assistant", "content": f"An error occurred: {e}"}
+        append_msg(error_message_dict)
+        # Render just the new message instead of rerunning the script to redraw the whole history
+        st.chat_message("assistant").write(error_message_dict["content"])
 
 
 # --- Streamlit UI Setup ---
@@ -281,7 +584,7 @@ def main():
     if "openai_model" not in st.session_state:
         st.session_state.openai_model = DEFAULT_OPENAI_MODEL
     if "messages" not in st.session_state:
-        st.session_state.messages = []
+        reset_messages()
     if "mcp_server_address" not in st.session_state:
         st.session_state.mcp_server_address = "http://localhost:8000/mcp" # Default
     if "mcp_connection_status" not in st.session_state:
@@ -291,6 +594,12 @@ def main():
         st.session_state.mcp_resources = []
     if "mcp_tool_schemas" not in st.session_state:
         st.session_state.mcp_tool_schemas = []
+    if "openai_tool_list" not in st.session_state:
+        st.session_state.openai_tool_list = []
+    if "mcp_display_templates" not in st.session_state:
+        st.session_state.mcp_display_templates = {}
+    if "mcp_connection" not in st.session_state:
+        st.session_state.mcp_connection = None
     if "selected_mcp_resource_uri" not in st.session_state:
         st.session_state.selected_mcp_resource_uri = ""
 
@@ -307,11 +616,15 @@ def main():
         if st.button("Connect to MCP Server"):
             if st.session_state.mcp_server_address:
                 # Run the async connection function
-                session, status_msg, resources, tool_schemas = asyncio.run(async_connect_mcp_server(st.session_state.mcp_server_address))
+                session, status_msg, resources, tool_schemas = run_async(async_connect_mcp_server(st.session_state.mcp_server_address))
                 st.session_state.mcp_session = session
                 st.session_state.mcp_connection_status = status_msg
                 st.session_state.mcp_resources = resources
                 st.session_state.mcp_tool_schemas = tool_schemas # Store fetched tool schemas
+                st.session_state.openai_tool_list = format_mcp_tools_for_openai(tool_schemas)
+                st.session_state.mcp_display_templates = get_display_templates(tool_schemas)
+                if st.session_state.openai_tool_list and logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Passing these tools to OpenAI: %s", orjson.dumps(st.session_state.openai_tool_list, option=orjson.OPT_INDENT_2).decode())
                 if session:
                     st.success(status_msg)
                     if tool_schemas:
@@ -345,7 +658,7 @@ def main():
                     if st.session_state.selected_mcp_resource_uri:
                         st.info(f"Reading: {st.session_state.selected_mcp_resource_uri}")
                         # Run async read resource
-                        content = asyncio.run(async_read_mcp_resource(st.session_state.mcp_server_address, st.session_state.selected_mcp_resource_uri))
+                        content = run_async(async_read_mcp_resource(st.session_state.mcp_server_address, st.session_state.selected_mcp_resource_uri))
                         st.text_area("Resource Content:", value=content, height=200)
                     else:
                         st.warning("No resource URI selected to read.")
@@ -358,7 +671,7 @@ def main():
             # For example, you could show a small notification that a tool was used
             # st.chat_message("assistant", avatar="🛠️").write(f"Tool {msg['name']} was called.")
             pass 
-        else:
+        elif msg["content"]: # Assistant messages that only carry tool_calls have nothing to show, as when streamed
             st.chat_message(msg["role"]).write(msg["content"])
 
     if prompt := st.chat_input("Enter your message here..."):
@@ -366,7 +679,7 @@ def main():
             st.error("Please enter your OpenAI API key in the sidebar.")
         else:
             # Run the async message handler
-            asyncio.run(handle_chat_message(prompt))
+            run_async(handle_chat_message(prompt))
 
 if __name__ == "__main__":
     main()
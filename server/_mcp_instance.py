@@ -0,0 +1,27 @@
+import functools
+from fastapi import FastAPI
+from fastmcp import FastMCP
+import orjson
+import pydantic_core
+
+# Create the FastAPI application instance shared by the server modules
+app = FastAPI(title="FastAPI app linked with MCP")
+
+# Values orjson can't encode natively (pydantic models, ...) are converted the way FastMCP's default encoder does
+_to_jsonable = functools.partial(pydantic_core.to_jsonable_python, fallback=str)
+
+def orjson_tool_serializer(data) -> str:
+    """Serialize tool results to compact JSON with orjson instead of FastMCP's indented default."""
+    return orjson.dumps(data, default=_to_jsonable).decode()
+
+@functools.cache
+def get_mcp_instance() -> FastMCP:
+    """
+    Return the FastMCP instance linked to `app`, creating it on first call.
+    FastMCP.from_fastapi introspects the app's routes when it is built, so register
+    FastAPI routes on `app` before the first call. Later calls return the same instance,
+    so every module registers its @tool()s on it and the introspection happens once.
+    """
+    # tool_serializer only applies to @tool() functions. Tools generated from FastAPI routes (GET /items) parse
+    # the route's response and re-encode it with FastMCP's indented default; fastmcp offers no hook for that path.
+    return FastMCP.from_fastapi(app=app, tool_serializer=orjson_tool_serializer)
@@ -1,8 +1,15 @@
 import asyncio
 import logging
-from fastapi import FastAPI
-from fastmcp import FastMCP
+from typing import Final, Optional
 import httpx
+import orjson
+import uvicorn
+from server._mcp_instance import app, get_mcp_instance
+
+try:
+    import uvloop
+except ImportError: # uvloop is not available on Windows; fall back to the default asyncio loop
+    uvloop = None
 
 # Configure basic logging
 logging.basicConfig(
@@ -17,24 +24,49 @@ TOKEN = os.getenv("CODEARTS_AUTH_TOKEN")
 if not TOKEN:
     raise RuntimeError("CODEARTS_AUTH_TOKEN environment variable is not set. Please set it to your CodeArts API token.")
 
+CODEARTS_BASE_URL = "https://cloudpipeline-ext.ap-southeast-3.myhuaweicloud.com"
+
+# Base64-encoded definition for new pipelines: a single stage with one empty agentless job and
+# the default auto trigger. Sent as-is in the create request: {"name": name, "definition": _PIPELINE_DEF_B64}
+_PIPELINE_DEF_B64: Final[str] = "eyJzdGFnZXMiOlt7Im5hbWUiOiJTdGFnZV8xIiwic2VxdWVuY2UiOiIwIiwiam9icyI6W3siaWQiOiIiLCJpZGVudGlmaWVyX29sZCI6bnVsbCwic3RhZ2VfaW5kZXgiOm51bGwsInR5cGUiOm51bGwsIm5hbWUiOiJOZXcgSm9iIiwiYXN5bmMiOm51bGwsImlkZW50aWZpZXIiOiJKT0JfSlhKd3ciLCJzZXF1ZW5jZSI6MCwiY29uZGl0aW9uIjoiJHt7IGRlZmF1bHQoKSB9fSIsInN0cmF0ZWd5Ijp7InNlbGVjdF9zdHJhdGVneSI6InNlbGVjdGVkIn0sInRpbWVvdXQiOiIiLCJyZXNvdXJjZSI6bnVsbCwic3RlcHMiOltdLCJzdGFnZV9pZCI6IjE3NDcwMzEyMzUzNzciLCJwaXBlbGluZV9pZCI6IjJmNWVkYzYxYjlhMjQxN2JhZGZlZjU1Mjg3Njc3NTBkIiwidW5maW5pc2hlZF9zdGVwcyI6bnVsbCwiY29uZGl0aW9uX3RhZyI6bnVsbCwiZXhlY190eXBlIjoiQUdFTlRMRVNTX0pPQiIsImRlcGVuZHNfb24iOltdLCJyZXVzYWJsZV9qb2JfaWQiOm51bGx9XSwiaWRlbnRpZmllciI6IjE3NDcwMzEyMzUzNzc1NTFhYmM5MS00NGE1LTQ4OTgtOWZiYi01YWUxMjBjOWM2ODgiLCJwcmUiOlt7InJ1bnRpbWVfYXR0cmlidXRpb24iOm51bGwsIm11bHRpX3N0ZXBfZWRpdGFibGUiOjAsIm9mZmljaWFsX3Rhc2tfdmVyc2lvbiI6bnVsbCwibmFtZSI6bnVsbCwidGFzayI6Im9mZmljaWFsX2RldmNsb3VkX2F1dG9UcmlnZ2VyIiwiYnVzaW5lc3NfdHlwZSI6bnVsbCwiaW5wdXRzIjpudWxsLCJlbnYiOm51bGwsInNlcXVlbmNlIjowLCJpZGVudGlmaWVyIjpudWxsLCJlbmRwb2ludF9pZHMiOm51bGx9XSwicG9zdCI6bnVsbCwiZGVwZW5kc19vbiI6W10sInJ1bl9hbHdheXMiOmZhbHNlLCJwaXBlbGluZV9pZCI6IjJmNWVkYzYxYjlhMjQxN2JhZGZlZjU1Mjg3Njc3NTBkIn1dfQ=="
+
+# Shared by every tool call so pooled connections and TLS sessions to CodeArts are reused
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared CodeArts HTTP client, creating it on first use."""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        _HTTP_CLIENT = httpx.AsyncClient(
+            http2=True,
+            base_url=CODEARTS_BASE_URL,
+            headers={"x-auth-token": TOKEN, "Content-Type": "application/json"},
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            timeout=httpx.Timeout(10.0, connect=3.0)
+        )
+    return _HTTP_CLIENT
+
+async def close_http_client():
+    """Close the shared CodeArts HTTP client, if it was created."""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
 
-# Create a FastAPI application instance
-app = FastAPI(title="FastAPI app linked with MCP")
 
-async def get_items_data_source_async() -> list[dict]:
-    """Helper function to provide item data asynchronously."""
-    logger.info("Executing get_items_data_source_async")
-    await asyncio.sleep(0.01) # Simulate tiny async I/O
+def get_items_data_source() -> list[dict]:
+    """Helper function to provide item data."""
+    logger.info("Executing get_items_data_source")
     return [{"id": "item_1", "name": "Item 1"}, {"id": "item_2", "name": "Item 2"}]
 
 @app.get("/items", response_model=list[dict]) # Added response_model for clarity
 async def http_get_items_endpoint():
     """FastAPI HTTP endpoint to get items."""
     logger.info("HTTP GET /items called")
-    return await get_items_data_source_async()
+    return get_items_data_source()
 
-# Initialize FastMCP, linking it to your FastAPI app
-mcp_instance = FastMCP.from_fastapi(app=app)
+# Get the shared FastMCP instance linked to the FastAPI app, now that its routes are registered
+mcp_instance = get_mcp_instance()
 
 @mcp_instance.tool()
 async def mcp0_codearts_get_pipelines(project_id: str) -> dict:
@@ -46,15 +78,13 @@ async def mcp0_codearts_get_pipelines(project_id: str) -> dict:
         dict: The pipelines list or error message.
     """
     logger.info(f"[MCP Tool] mcp0_codearts_get_pipelines called with project_id={project_id}")
-    url = f"https://cloudpipeline-ext.ap-southeast-3.myhuaweicloud.com/v5/{project_id}/api/pipelines/list"
-    headers = {"x-auth-token": TOKEN}
     body = {}
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=body, timeout=10)
-            response.raise_for_status()
-            pipelines = response.json()
-            return pipelines
+        client = get_http_client()
+        response = await client.post(f"/v5/{project_id}/api/pipelines/list", content=orjson.dumps(body))
+        response.raise_for_status()
+        pipelines = orjson.loads(response.content)
+        return pipelines
     except httpx.HTTPStatusError as e:
         logger.error(f"HTTP error: {e.response.status_code} - {e.response.text}")
         return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
@@ -62,7 +92,8 @@ async def mcp0_codearts_get_pipelines(project_id: str) -> dict:
         logger.error(f"General error: {type(e).__name__} - {e}")
         return {"error": f"General error: {type(e).__name__} - {str(e)}"}
 
-@mcp_instance.tool()
+# "x-display-template" lets the client show the result directly instead of summarizing it with the LLM
+@mcp_instance.tool(annotations={"x-display-template": "Created CodeArts pipeline with ID `{pipeline_id}`."})
 async def mcp0_codearts_create_pipeline(name: str, project_id: str) -> dict:
     """
     Create a CodeArts pipeline for a given project ID.
@@ -73,17 +104,13 @@ async def mcp0_codearts_create_pipeline(name: str, project_id: str) -> dict:
         dict: The creation status or error message.
     """
     logger.info(f"[MCP Tool] mcp0_codearts_create_pipeline called with name={name}, project_id={project_id}")
-    url = f"https://cloudpipeline-ext.ap-southeast-3.myhuaweicloud.com/v5/{project_id}/api/pipelines"
-    headers = {"x-auth-token": TOKEN, "Content-Type": "application/json"}
-
-    pipelineDefinition = "eyJzdGFnZXMiOlt7Im5hbWUiOiJTdGFnZV8xIiwic2VxdWVuY2UiOiIwIiwiam9icyI6W3siaWQiOiIiLCJpZGVudGlmaWVyX29sZCI6bnVsbCwic3RhZ2VfaW5kZXgiOm51bGwsInR5cGUiOm51bGwsIm5hbWUiOiJOZXcgSm9iIiwiYXN5bmMiOm51bGwsImlkZW50aWZpZXIiOiJKT0JfSlhKd3ciLCJzZXF1ZW5jZSI6MCwiY29uZGl0aW9uIjoiJHt7IGRlZmF1bHQoKSB9fSIsInN0cmF0ZWd5Ijp7InNlbGVjdF9zdHJhdGVneSI6InNlbGVjdGVkIn0sInRpbWVvdXQiOiIiLCJyZXNvdXJjZSI6bnVsbCwic3RlcHMiOltdLCJzdGFnZV9pZCI6IjE3NDcwMzEyMzUzNzciLCJwaXBlbGluZV9pZCI6IjJmNWVkYzYxYjlhMjQxN2JhZGZlZjU1Mjg3Njc3NTBkIiwidW5maW5pc2hlZF9zdGVwcyI6bnVsbCwiY29uZGl0aW9uX3RhZyI6bnVsbCwiZXhlY190eXBlIjoiQUdFTlRMRVNTX0pPQiIsImRlcGVuZHNfb24iOltdLCJyZXVzYWJsZV9qb2JfaWQiOm51bGx9XSwiaWRlbnRpZmllciI6IjE3NDcwMzEyMzUzNzc1NTFhYmM5MS00NGE1LTQ4OTgtOWZiYi01YWUxMjBjOWM2ODgiLCJwcmUiOlt7InJ1bnRpbWVfYXR0cmlidXRpb24iOm51bGwsIm11bHRpX3N0ZXBfZWRpdGFibGUiOjAsIm9mZmljaWFsX3Rhc2tfdmVyc2lvbiI6bnVsbCwibmFtZSI6bnVsbCwidGFzayI6Im9mZmljaWFsX2RldmNsb3VkX2F1dG9UcmlnZ2VyIiwiYnVzaW5lc3NfdHlwZSI6bnVsbCwiaW5wdXRzIjpudWxsLCJlbnYiOm51bGwsInNlcXVlbmNlIjowLCJpZGVudGlmaWVyIjpudWxsLCJlbmRwb2ludF9pZHMiOm51bGx9XSwicG9zdCI6bnVsbCwiZGVwZW5kc19vbiI6W10sInJ1bl9hbHdheXMiOmZhbHNlLCJwaXBlbGluZV9pZCI6IjJmNWVkYzYxYjlhMjQxN2JhZGZlZjU1Mjg3Njc3NTBkIn1dfQ=="
-    json_data = {"name": name, "definition": pipelineDefinition}
+    json_data = {"name": name, "definition": _PIPELINE_DEF_B64}
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=json_data, timeout=10)
-            response.raise_for_status()
-            result = response.json()
-            return result
+        client = get_http_client()
+        response = await client.post(f"/v5/{project_id}/api/pipelines", content=orjson.dumps(json_data))
+        response.raise_for_status()
+        result = orjson.loads(response.content)
+        return result
     except httpx.HTTPStatusError as e:
         logger.error(f"HTTP error: {e.response.status_code} - {e.response.text}")
         return {"error": f"HTTP error: {e.response.status_code} - {e.response.text}"}
@@ -91,9 +118,22 @@ async def mcp0_codearts_create_pipeline(name: str, project_id: str) -> dict:
         logger.error(f"General error: {type(e).__name__} - {e}")
         return {"error": f"General error: {type(e).__name__} - {str(e)}"}
 
+async def serve():
+    """Serve the MCP endpoint, closing the shared CodeArts client on shutdown."""
+    # For deeper debugging of HTTP/transport issues, you might try log_level="trace"
+    # Same shutdown settings as FastMCP's own runner: clients hold an SSE stream open, so don't wait for it to close
+    config = uvicorn.Config(
+        mcp_instance.http_app(path="/mcp"), host="0.0.0.0", port=8000, http="httptools",
+        timeout_graceful_shutdown=0, lifespan="on",
+    )
+    try:
+        await uvicorn.Server(config).serve()
+    finally:
+        await close_http_client()
+
 if __name__ == "__main__":
-    logger.info("Starting server with mcp_instance.run() on http://0.0.0.0:8000/mcp")
-    # For deeper debugging of HTTP/transport issues, you might try running Uvicorn directly:
-    # import uvicorn
-    # uvicorn.run(mcp_instance.http_app(), host="0.0.0.0", port=8000, log_level="trace")
-    mcp_instance.run(transport="streamable-http", host="0.0.0.0", port=8000, path="/mcp")
+    logger.info("Starting server with uvicorn on http://0.0.0.0:8000/mcp")
+    if uvloop is not None:
+        uvloop.run(serve()) # Serve on a libuv-backed event loop
+    else:
+        asyncio.run(serve())